@@ -11,7 +11,7 @@ from src.utils import Workflow
 workflow = Workflow()
 
 # Set the cache tag
-workflow.cache_tag = "v2"
+workflow.cache_tag = "v3"
 
 # Define the paths where I will save things
 paths = workflow.paths
@@ -48,6 +48,7 @@ workflow.add_stage(
     "plot increments",
     PlotIncrements,
     paths.figures / "increments.pdf",
+    dependencies="download data",
 )
 
 workflow.add_stage(
@@ -57,6 +58,7 @@ workflow.add_stage(
         paths.models / "incat_emulator.pkl",
         paths.models / "incat_emulator_losses.pkl",
     ],
+    dependencies="download data",
     cache=True,
     seed=1,
 )
@@ -5,7 +5,7 @@ import numpy as np
 import pandas as pd
 from pzflow import Flow, FlowEnsemble
 
-from src.utils import Stage, observe_catalog, split_seed
+from src.utils import Stage, observe_catalog, parse_model_name, split_seed
 
 jax.config.update("jax_platform_name", "cpu")
 
@@ -48,20 +48,16 @@ class CreateInferenceCatalogs(Stage):
             ens = FlowEnsemble(file=self.paths.models / f"{name}_ensemble.pkl")
 
             # Add observational errors to the sample
-            if "truth" in file.name:
+            config = parse_model_name(name)
+            if config is None:
                 obs = truth
                 obs = obs.rename(columns={"u": "u0"})
             else:
-                year = int(name.split("_")[0][1:])
-                euclid = "euclid" in name
-                roman = "roman" in name
                 obs = observe_catalog(
                     cat_truth=truth,
-                    n_years=year,
                     min_snr=5,
-                    euclid=euclid,
-                    roman=roman,
                     seed=seed_obs,
+                    **config,
                 )
 
             # Perform inference on redshift and u band
@@ -1,14 +1,124 @@
 """Train the ensembles for photo-z and u0 estimation. """
 
 import pickle
+from pathlib import Path
 
 import jax.numpy as jnp
+import numpy as np
 import optax
+import pandas as pd
+from joblib import Parallel, delayed
 from pzflow import Flow, FlowEnsemble
 from pzflow.bijectors import Chain, RollingSplineCoupling, ShiftBounds
 from pzflow.distributions import CentBeta13
 
-from src.utils import Stage, observe_catalog, split_seed
+from src.utils import Stage, observe_catalog, parse_model_name, split_seed
+
+
+def _train_ensemble(
+    truth: pd.DataFrame,
+    config: dict | None,
+    cat_seed: int,
+    n_flows: int,
+    learning_rates: list,
+    epochs: list,
+    train_seeds: np.ndarray,
+    ens_file: Path,
+    loss_file: Path,
+) -> None:
+    """Train and save a single FlowEnsemble.
+
+    This is a module-level function so that it can be dispatched to
+    joblib workers. The training catalog is built here, so that each
+    worker only holds its own catalog in memory.
+
+    Parameters
+    ----------
+    truth : pd.DataFrame
+        The truth catalog from which to build the training catalog
+    config : dict or None
+        The observing configuration of the model, as returned by
+        parse_model_name. If None, the truth catalog is used.
+    cat_seed : int
+        The random seed for observing the training catalog
+    n_flows : int
+        The number of flows in the ensemble
+    learning_rates : list
+        The learning rate for each stage of training
+    epochs : list
+        The number of epochs for each stage of training
+    train_seeds : np.ndarray
+        The random seed for each stage of training
+    ens_file : Path
+        The file in which to save the ensemble
+    loss_file : Path
+        The file in which to save the training losses
+    """
+    # Get the training catalog
+    if config is None:
+        train = truth.rename(columns={"u": "u0"})
+    else:
+        train = observe_catalog(
+            cat_truth=truth,
+            min_snr=5,
+            seed=cat_seed,
+            **config,
+        )
+
+    # Condition on everything except the data columns, the errors,
+    # and the observed u band
+    excluded = {"u", "redshift", "u0"}
+    conditional_columns = [
+        col for col in train.columns if col not in excluded and not col.endswith("_err")
+    ]
+
+    data_columns = ["redshift", "u0"]
+
+    # Determine range for the data columns
+    mins = jnp.array([0, train.u0.min() - 0.5])
+    maxs = jnp.array([4, train.u0.max() + 0.5])
+
+    # Create the bijector
+    bijector = Chain(
+        ShiftBounds(mins, maxs),
+        RollingSplineCoupling(nlayers=2, n_conditions=len(conditional_columns)),
+    )
+
+    # Create the ensemble
+    ensemble = FlowEnsemble(
+        data_columns=data_columns,
+        conditional_columns=conditional_columns,
+        bijector=bijector,
+        latent=CentBeta13(len(data_columns)),
+        N=n_flows,
+    )
+
+    # Train the ensembles
+    print(f"Training {ens_file.name}")
+    losses = [
+        ensemble.train(
+            train,
+            optimizer=optax.adam(lr),
+            epochs=ep,
+            seed=ts,
+            verbose=True,
+        )
+        for lr, ep, ts in zip(learning_rates, epochs, train_seeds)
+    ]
+
+    # Repackage losses from each stage of training so each
+    # is a dict of flow_name: all_losses
+    combined_losses = {
+        fname: np.concatenate(  # For each flow trained in the ensemble...
+            [np.asarray(lossDict[fname], dtype=float) for lossDict in losses]
+        ).tolist()  # Save the list of training losses
+        for fname in losses[0]
+    }
+
+    # Save the ensemble and losses
+    ensemble.save(ens_file)
+    with open(loss_file, "wb") as file:
+        pickle.dump(combined_losses, file)
 
 
 class TrainEnsembles(Stage):
@@ -25,6 +135,7 @@ class TrainEnsembles(Stage):
         learning_rates = self.stage_vars.learning_rates
         epochs = self.stage_vars.epochs
         seed = self.stage_vars.seed
+        n_jobs = getattr(self.stage_vars, "n_jobs", 1)
 
         # Split seed
         seed1, seed2 = split_seed(seed, 2)
@@ -35,74 +146,29 @@ class TrainEnsembles(Stage):
         emulator = Flow(file=self.paths.models / "incat_emulator.pkl")
         truth = emulator.sample(100_000, seed=seed)
 
-        for i, (ens_file, loss_file) in enumerate(zip(ensemble_files, loss_files)):
-            # Get the training catalog and the column names
-            if "truth" in ens_file.name:
-                train = truth.rename(columns={"u": "u0"})
-                conditional_columns = train.columns
-            else:
-                year = int(ens_file.name.split("_")[0][1:])
-                euclid = "euclid" in ens_file.name
-                roman = "roman" in ens_file.name
-                train = observe_catalog(
-                    cat_truth=truth,
-                    n_years=year,
-                    min_snr=5,
-                    euclid=euclid,
-                    roman=roman,
-                    seed=cat_seeds[i],
-                )
-                conditional_columns = train.columns.drop(
-                    [col for col in train.columns if "_err" in col or col == "u"]
-                )
-
-            data_columns = ["redshift", "u0"]
-            conditional_columns = conditional_columns.drop(data_columns)
-
-            # Determine range for the data columns
-            mins = jnp.array([0, train.u0.min() - 0.5])
-            maxs = jnp.array([4, train.u0.max() + 0.5])
-
-            # Create the bijector
-            bijector = Chain(
-                ShiftBounds(mins, maxs),
-                RollingSplineCoupling(nlayers=2, n_conditions=len(conditional_columns)),
+        # Parse the observing configuration of each model
+        configs = [
+            parse_model_name(file.name.removesuffix("_ensemble.pkl"))
+            for file in ensemble_files
+        ]
+
+        # Prepare the training jobs
+        jobs = [
+            delayed(_train_ensemble)(
+                truth=truth,
+                config=config,
+                cat_seed=cat_seed,
+                n_flows=n_flows,
+                learning_rates=learning_rates,
+                epochs=epochs,
+                train_seeds=train_seeds,
+                ens_file=ens_file,
+                loss_file=loss_file,
             )
-
-            # Create the ensemble
-            ensemble = FlowEnsemble(
-                data_columns=data_columns,
-                conditional_columns=conditional_columns,
-                bijector=bijector,
-                latent=CentBeta13(len(data_columns)),
-                N=n_flows,
+            for config, cat_seed, ens_file, loss_file in zip(
+                configs, cat_seeds, ensemble_files, loss_files
             )
+        ]
 
-            # Train the ensembles
-            print(f"Training {ens_file.name}")
-            losses = [
-                ensemble.train(
-                    train,
-                    optimizer=optax.adam(lr),
-                    epochs=ep,
-                    seed=ts,
-                    verbose=True,
-                )
-                for lr, ep, ts in zip(learning_rates, epochs, train_seeds)
-            ]
-
-            # Repackage losses from each stage of training so each
-            # is a dict of flow_name: all_losses
-            combined_losses = {
-                fname: [  # For each flow trained in the ensemble...
-                    float(loss)  # Save the list of training losses
-                    for lossDict in losses
-                    for loss in lossDict[fname]
-                ]
-                for fname in losses[0]
-            }
-
-            # Save the ensemble and losses
-            ensemble.save(ens_file)
-            with open(loss_file, "wb") as file:
-                pickle.dump(combined_losses, file)
+        # Train the ensembles, which are independent of each other
+        Parallel(n_jobs=n_jobs)(jobs)
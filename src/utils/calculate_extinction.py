@@ -1,12 +1,57 @@
 """Module to calculate the expected Lyman-alpha magnitude increment."""
 
+import copy
+import functools
 import re
 from pathlib import Path
 
-import git
+import jax
+import jax.numpy as jnp
 import numpy as np
+from jax.scipy.integrate import trapezoid
 
 from .constants import LYMAN_WAVELEN
+from .misc import find_repo_root
+
+
+@jax.jit
+def _increment_kernel(
+    wavelen: jax.Array,
+    R: jax.Array,
+    z_bp: jax.Array,
+    F_bp: jax.Array,
+    z_sc: jax.Array,
+) -> jax.Array:
+    """Tabulate the Lya increments on the grid of source redshifts.
+
+    JAX evaluates this in single precision by default, which is plenty for
+    increments that only need mmag precision. The function is re-compiled
+    for each new bandpass window size, and then cached.
+
+    Parameters
+    ----------
+    wavelen: jax.Array
+        Bandpass wavelengths in angstroms
+    R: jax.Array
+        Bandpass response at the wavelengths
+    z_bp: jax.Array
+        Lya redshifts corresponding to the bandpass wavelengths
+    F_bp: jax.Array
+        Mean Lya transmission at the bandpass redshifts
+    z_sc: jax.Array
+        Grid of source redshifts
+
+    Returns
+    -------
+    jax.Array
+        Lya increments on the source redshift grid
+    """
+    # Beyond source redshift, set transmission = 1
+    F_grid = jnp.where(z_bp[None, :] > z_sc[:, None], 1.0, F_bp[None, :])
+
+    # Calculate the increments
+    incr = -2.5 * jnp.log10(trapezoid(R * F_grid, wavelen, axis=-1))
+    return incr - incr.min()
 
 
 class Bandpass:
@@ -74,7 +119,7 @@ class Bandpass:
             The weights used to re-weight the bandpass. Must be non-negative.
         """
         # Check that all weights are positive
-        if any(weights < 0):
+        if np.any(weights < 0):
             raise ValueError("The weights must be non-negative.")
 
         # Re-grid the weights
@@ -119,8 +164,7 @@ class ExtinctionCalculator:
             File pattern for loading bandpass files.
         """
         # Get the root directory
-        git_repo = git.Repo(".", search_parent_directories=True)
-        root = Path(git_repo.working_tree_dir).absolute()
+        root = find_repo_root()
 
         # Get all the files matching the pattern
         pattern = str(bandpass_pattern)
@@ -136,6 +180,9 @@ class ExtinctionCalculator:
             # Save in dictionary
             self.bandpasses[band] = Bandpass(file)
 
+        # Cache of tabulated increments, keyed by (band, spectral_index)
+        self._increments = {}
+
     def tau_eff(self, z: np.ndarray | float) -> np.ndarray | float:
         """Return the effective optical depth of the Lyman-alpha Forest at redshift z.
 
@@ -151,7 +198,11 @@ class ExtinctionCalculator:
         """
         # Parameters of the mean Lyman-alpha optical depth
         # values from https://arxiv.org/abs/1904.01110
-        return self.TAU_0 * (1 + z) ** self.TAU_GAMMA
+        # (operations are done in place so arrays only allocate one buffer)
+        tau = np.add(z, 1.0)
+        tau **= self.TAU_GAMMA
+        tau *= self.TAU_0
+        return tau
 
     def F_bar(self, z: np.ndarray | float) -> np.ndarray | float:
         """Return the mean Lyman-alpha transmission at redshift z.
@@ -166,7 +217,9 @@ class ExtinctionCalculator:
         np.ndarray or float
             The mean Lyman-alpha transmission.
         """
-        return np.exp(-self.tau_eff(z))
+        F = self.tau_eff(z)
+        F *= -1
+        return np.exp(F, out=F) if isinstance(F, np.ndarray) else np.exp(F)
 
     def lya_increment(
         self,
@@ -197,9 +250,41 @@ class ExtinctionCalculator:
         np.ndarray or float
             Lyman-alpha increments.
         """
-        # Get the bandpass
+        # The tabulated increments only depend on the band and spectral index,
+        # so we only need to calculate them once
+        key = (band, spectral_index)
+        if key not in self._increments:
+            self._increments[key] = self._tabulate_increments(band, spectral_index)
+        z_sc, incr = self._increments[key]
+
+        # Return increments at requested redshifts
+        return np.interp(redshift, z_sc, incr)
+
+    def _tabulate_increments(
+        self,
+        band: str,
+        spectral_index: float,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Tabulate the mean Lya increment for the band on a grid of redshifts.
+
+        Parameters
+        ----------
+        band: str
+            Name of the band to calculate increment for.
+        spectral_index: float
+            Controls the mean galaxy spectrum. See lya_increment.
+
+        Returns
+        -------
+        np.ndarray
+            The grid of source redshifts
+        np.ndarray
+            Lyman-alpha increments on the redshift grid
+        """
+        # Get a copy of the bandpass
+        # (we re-weight the copy, as the bandpass may be shared between threads)
         try:
-            bandpass = self.bandpasses[band]
+            bandpass = copy.copy(self.bandpasses[band])
         except KeyError:
             raise KeyError(
                 f"Band '{band}' not found. "
@@ -213,10 +298,12 @@ class ExtinctionCalculator:
         # Get window where bandpass is non-zero
         wavelen = bandpass.wavelen
         R = bandpass.R(wavelen)
+        # (the cumulative sum is non-decreasing, so the window is contiguous)
         cumsum = np.cumsum(R[:-1] * np.diff(wavelen))
-        mask = (cumsum >= 1e-3) & (cumsum <= 1 - 1e-3)
-        wavelen = wavelen[:-1][mask]
-        R = R[:-1][mask]
+        lo = np.searchsorted(cumsum, 1e-3, side="left")
+        hi = np.searchsorted(cumsum, 1 - 1e-3, side="right")
+        wavelen = wavelen[lo:hi]
+        R = R[lo:hi]
 
         # Convert bandpass wavelengths to redshift
         z_bp = wavelen / LYMAN_WAVELEN - 1
@@ -228,18 +315,42 @@ class ExtinctionCalculator:
         dz = 0.01
         z_sc = np.arange(z_bp.min(), z_bp.max(), dz)
 
-        # Tile bandpass arrays to match dimension of z_sc
-        z_bp = np.tile(z_bp, (z_sc.size, 1))
-        wavelen = np.tile(wavelen, (z_sc.size, 1))
-        R = np.tile(R, (z_sc.size, 1))
-        F_grid = np.tile(F_grid, (z_sc.size, 1))
-
-        # Beyond source redshift, set transmission = 1
-        F_grid[z_bp > z_sc[:, None]] = 1
-
         # Calculate the increments
-        incr = -2.5 * np.log10(np.trapz(R * F_grid, wavelen))
-        incr = incr.squeeze() - incr.min()
-
-        # Finally, return increments at requested redshifts
-        return np.interp(redshift, z_sc, incr.squeeze())
+        incr = _increment_kernel(wavelen, R, z_bp, F_grid, z_sc)
+        incr = np.asarray(incr, dtype=np.float64)
+
+        return z_sc, incr
+
+
+@functools.cache
+def _default_calculator() -> ExtinctionCalculator:
+    """Return the ExtinctionCalculator shared by the module-level functions."""
+    return ExtinctionCalculator()
+
+
+def lya_increment(
+    redshift: np.ndarray | float,
+    band: str,
+    spectral_index: float = -2,
+) -> np.ndarray | float:
+    """Calculate mean Lya increment for the given band as a function of redshift.
+
+    This uses a single ExtinctionCalculator that is shared by every call, so
+    the bandpasses are only located and loaded once per process.
+    See ExtinctionCalculator.lya_increment for details.
+
+    Parameters
+    ----------
+    redshift: np.ndarray or float
+        Array of redshifts at which to calculate the increment.
+    band: str
+        Name of the band to calculate increment for.
+    spectral_index: float, default=-2
+        Controls the mean galaxy spectrum.
+
+    Returns
+    -------
+    np.ndarray or float
+        Lyman-alpha increments.
+    """
+    return _default_calculator().lya_increment(redshift, band, spectral_index)
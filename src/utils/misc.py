@@ -1,19 +1,91 @@
-"""Utility function for random seeds."""
+"""Miscellaneous utility functions."""
+
+import functools
+from pathlib import Path
 
 import numpy as np
 
 
-def split_seed(seed: int, N: int = 2, max_seed: int = 2**32 - 1) -> np.ndarray:
+def split_seed(seed: int, N: int = 2) -> np.ndarray:
     """Split the random seed.
 
+    The child seeds are drawn from a numpy SeedSequence, so they are
+    independent 32-bit seeds that are safe to pass to numpy, pandas and JAX.
+
     Parameters
     ----------
     seed : int
         The initial seed
     N : int, default=2
         The number of seeds to produce
-    max_seed : int, default=2**32 - 1
-        The maximum allowed value for seeds
+
+    Returns
+    -------
+    np.ndarray
+        Array of N unsigned 32-bit seeds
+    """
+    return np.random.SeedSequence(seed).generate_state(N)
+
+
+def parse_model_name(name: str) -> dict | None:
+    """Parse the observing configuration encoded in a model name.
+
+    Model names are either "truth", or "y<years>" optionally followed by
+    "_euclid" or "_roman", e.g. "y10_euclid".
+
+    Parameters
+    ----------
+    name : str
+        The model name
+
+    Returns
+    -------
+    dict or None
+        The n_years, euclid, and roman keywords for observe_catalog,
+        or None if the model uses the truth catalog.
+    """
+    if "truth" in name:
+        return None
+
+    return {
+        "n_years": int(name.split("_")[0][1:]),
+        "euclid": "euclid" in name,
+        "roman": "roman" in name,
+    }
+
+
+def find_repo_root(path: str | Path = ".") -> Path:
+    """Return the root directory of the git repository containing the path.
+
+    This walks up the directory tree looking for .git, which is much cheaper
+    than importing GitPython and opening the repository.
+
+    Parameters
+    ----------
+    path : str or Path, default="."
+        The path from which to start the search
+
+    Returns
+    -------
+    Path
+        The absolute path of the repository root
+
+    Raises
+    ------
+    FileNotFoundError
+        If the path is not inside a git repository
+    """
+    return _search_repo_root(Path(path).absolute())
+
+
+@functools.cache
+def _search_repo_root(path: Path) -> Path:
+    """Search upwards from the absolute path for the git repository root.
+
+    Results are cached, as every stage looks up the root when it is created.
     """
-    rng = np.random.default_rng(seed)
-    return rng.integers(0, max_seed, size=N)
+    for directory in [path, *path.parents]:
+        if (directory / ".git").exists():
+            return directory
+
+    raise FileNotFoundError(f"'{path}' is not inside a git repository.")
@@ -1,14 +1,56 @@
 """Utility function that converts a truth catalog to an observed catalog."""
 
+import functools
+
 import numpy as np
 import pandas as pd
 from photerr import EuclidErrorModel, LsstErrorModel, RomanErrorModel
-from scipy.interpolate import griddata
 
-from .calculate_extinction import ExtinctionCalculator
+from .calculate_extinction import lya_increment
 from .misc import split_seed
 
 
+@functools.lru_cache(maxsize=32)
+def _get_lsst_error_model(n_years: float) -> LsstErrorModel:
+    """Return the LSST error model for the given number of years.
+
+    Parameters
+    ----------
+    n_years : float
+        The number of years observed in LSST
+
+    Returns
+    -------
+    LsstErrorModel
+        The LSST error model
+    """
+    return LsstErrorModel(
+        nYrObs=n_years,
+        airmass=1.2,
+        sigLim=0,
+        absFlux=True,
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _get_i_limit(n_years: float, min_snr: float) -> float:
+    """Return the LSST i band limiting magnitude.
+
+    Parameters
+    ----------
+    n_years : float
+        The number of years observed in LSST
+    min_snr : float
+        The SNR that defines the limiting magnitude
+
+    Returns
+    -------
+    float
+        The i band limiting magnitude
+    """
+    return _get_lsst_error_model(n_years).getLimitingMags(nSigma=min_snr)["i"]
+
+
 def observe_catalog(
     cat_truth: pd.DataFrame,
     n_years: float,
@@ -45,40 +87,44 @@ def observe_catalog(
     # Split the seed
     seed_lsst, seed_euclid, seed_roman = split_seed(seed, 3)
 
-    # Create the observed catalog
-    cat_obs = cat_truth.copy()
+    # Determine which of the Euclid and Roman bands we don't need
+    if euclid:
+        unused = ["F"]
+    elif roman:
+        unused = []
+    else:
+        unused = list("YJHF")
+    columns = [col for col in cat_truth.columns if col not in unused]
 
-    # Cut the low and high redshift artifacts
-    cat_obs = cat_obs[(cat_obs.redshift > 0.2) & (cat_obs.redshift < 3.5)]
+    # Create the observed catalog, cutting the low and high redshift artifacts
+    # (we cut before copying so that we only copy the galaxies and bands we keep)
+    z = cat_truth["redshift"].to_numpy()
+    mask = z > 0.2
+    mask &= z < 3.5
+    cat_obs = cat_truth.loc[mask, columns].copy()
 
     # Add Lya extinction
-    ec = ExtinctionCalculator()
-    cat_obs["u0"] = cat_obs.u.copy()
-    cat_obs.u += ec.lya_increment(cat_obs.redshift, "u")
+    cat_obs["u0"] = cat_obs["u"].to_numpy(copy=True)
+    u = cat_obs["u"].to_numpy(copy=True)
+    u += lya_increment(cat_obs["redshift"].to_numpy(), "u")
+    cat_obs["u"] = u
 
     # Add LSST errors
-    lsst_error_model = LsstErrorModel(
-        nYrObs=n_years,
-        airmass=1.2,
-        sigLim=0,
-        absFlux=True,
-    )
+    # (error models and limiting mags are cached across calls)
+    lsst_error_model = _get_lsst_error_model(n_years)
     cat_obs = lsst_error_model(cat_obs, random_state=seed_lsst)
-    i_limit = lsst_error_model.getLimitingMags(nSigma=min_snr)["i"]
-    cat_obs = cat_obs[cat_obs.i <= i_limit]
+    i_limit = _get_i_limit(n_years, min_snr)
+    cat_obs = cat_obs[cat_obs.i <= i_limit].reset_index(drop=True)
 
     # Handle Euclid and Roman bands
     if euclid:
         euclid_error_model = EuclidErrorModel()
         cat_obs = euclid_error_model(cat_obs, random_state=seed_euclid)
-        cat_obs = cat_obs.drop("F", axis=1)
     elif roman:
         roman_error_model = RomanErrorModel()
         cat_obs = roman_error_model(cat_obs, random_state=seed_roman)
-    else:
-        cat_obs = cat_obs.drop(list("YJHF"), axis=1)
 
     # Drop any galaxies that aren't observed in all the bands
-    cat_obs = cat_obs[np.isfinite(cat_obs).all(axis=1)]
+    cat_obs = cat_obs[np.isfinite(cat_obs.to_numpy()).all(axis=1)]
 
     return cat_obs
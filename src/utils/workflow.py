@@ -1,23 +1,296 @@
 """Define the workflow class"""
 
+import configparser
 import contextlib
+import functools
 import hashlib
+import io
 import json
 import os
+import threading
 import warnings
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from inspect import getfile
 from pathlib import Path
 from types import SimpleNamespace
-from typing import ContextManager
+from typing import TYPE_CHECKING, Callable, ContextManager, Iterator
 
-import git
-import github_release
-import humanize
-import typer
 from rich import print
 
+from .misc import find_repo_root
+
+if TYPE_CHECKING:
+    import requests
+    import typer
+
+# github_release, humanize, requests and typer are imported in the
+# functions that use them, so that workflows that never touch the cache or
+# the CLI don't pay to import them
+
+
+def _normalize_dependencies(dependencies: str | list | tuple | None) -> tuple:
+    """Return the stage dependencies as a tuple of stage names.
+
+    Parameters
+    ----------
+    dependencies : str or list or tuple or None
+        The stage(s) on which a stage depends
+
+    Returns
+    -------
+    tuple
+        The names of the stages on which the stage depends
+    """
+    if dependencies is None:
+        return ()
+    elif isinstance(dependencies, (tuple, list)):
+        return tuple(dependencies)
+    else:
+        return (dependencies,)
+
+
+class _NullWriter(io.TextIOBase):
+    """Text stream that discards everything written to it."""
+
+    def write(self, text: str) -> int:
+        """Discard the text."""
+        return len(text)
+
+
+class _GithubReleaseError(Exception):
+    """A failure reported by github_release with a plain Exception."""
+
+
+@contextlib.contextmanager
+def _github_release_errors() -> Iterator[None]:
+    """Re-raise the plain Exceptions raised by github_release as cache errors.
+
+    github_release reports failures such as a missing release with plain
+    Exceptions. These are converted to _GithubReleaseError, so they can be
+    caught without also catching the more specific exceptions due to bugs.
+    """
+    try:
+        yield
+    except Exception as exc:
+        if type(exc) is Exception:
+            raise _GithubReleaseError(*exc.args) from exc
+        raise
+
+
+# Errors that mean the remote cache couldn't be reached or updated
+# (requests' exceptions are OSErrors, a missing "origin" remote or
+# malformed API response raises a KeyError, and an unreadable git config
+# raises a configparser.Error)
+_CACHE_ERRORS = (OSError, KeyError, configparser.Error, _GithubReleaseError)
+
+
+def _typer_help(method: Callable) -> Callable:
+    """Create a decorator that gives a CLI command the docstring of a method.
+
+    Typer re-wraps paragraphs in the help text, so we insert the \\b marker
+    that tells it to leave the following paragraph as written.
+
+    Parameters
+    ----------
+    method : Callable
+        The method whose docstring is used for the command help
+
+    Returns
+    -------
+    Callable
+        Decorator that sets the docstring of the command
+    """
+    doc = (method.__doc__ or "").replace("\n\n", "\n\n\b")
+
+    def decorator(command: Callable) -> Callable:
+        command.__doc__ = doc
+        return command
+
+    return decorator
+
+
+# Lock for reading and writing the stage history
+_stage_history_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_file(file: Path) -> str:
+    """Return the hash of the file contents.
+
+    Results are cached, as many stages can be defined in the same file.
+    Workflow.run and Workflow.query_stages clear the cache so that edits
+    are picked up.
+
+    Parameters
+    ----------
+    file : Path
+        The file to hash
+
+    Returns
+    -------
+    str
+        Hash as a hexadecimal equivalent encoded string
+    """
+    with open(file, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _file_digest(file: Path) -> str:
+    """Return the SHA-256 digest of the file contents.
+
+    The digest is formatted like the "digest" field of Github release assets.
+
+    Parameters
+    ----------
+    file : Path
+        The file to hash
+
+    Returns
+    -------
+    str
+        The digest, in the form "sha256:<hex>"
+    """
+    with open(file, "rb") as f:
+        return "sha256:" + hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _download_asset(
+    session: "requests.Session",
+    github_name: str,
+    asset: dict,
+    file: Path,
+) -> None:
+    """Download a release asset to the given file.
+
+    Unlike github_release.gh_asset_download, this writes directly to the
+    destination rather than the current working directory, so several
+    downloads can run at once. The asset is streamed to a temporary file
+    that replaces the destination once complete.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session used to make the request
+    github_name : str
+        The name of the Github repository, in the form owner/repo
+    asset : dict
+        The asset info returned by the Github API
+    file : Path
+        The destination of the download
+    """
+    import github_release
+
+    # Stream the asset to a temporary file
+    # (requests drops the credentials when redirected to the storage host)
+    url = f"{github_release.github_api_url()}/repos/{github_name}"
+    url += f"/releases/assets/{asset['id']}"
+    tmp = file.with_name(file.name + ".part")
+    try:
+        with session.get(
+            url,
+            headers={"Accept": "application/octet-stream"},
+            stream=True,
+            timeout=60,
+        ) as response:
+            response.raise_for_status()
+            with open(tmp, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+    except BaseException:
+        # Don't leave a partial download in the output directory
+        tmp.unlink(missing_ok=True)
+        raise
+
+    # Move the completed download into place
+    os.replace(tmp, file)
+
+
+def _list_assets(
+    session: "requests.Session",
+    github_name: str,
+    release_id: int,
+) -> list:
+    """List the assets of a release.
+
+    Unlike github_release.get_assets, this uses the known release ID rather
+    than listing every release to look it up by tag.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session used to make the requests
+    github_name : str
+        The name of the Github repository, in the form owner/repo
+    release_id : int
+        The ID of the release
+
+    Returns
+    -------
+    list
+        The asset info returned by the Github API
+    """
+    import github_release
+
+    url = f"{github_release.github_api_url()}/repos/{github_name}"
+    url += f"/releases/{release_id}/assets?per_page=100"
+
+    # Follow the pagination links until we have every asset
+    assets = []
+    while url is not None:
+        response = session.get(url, timeout=60)
+        response.raise_for_status()
+        assets.extend(response.json())
+        url = response.links.get("next", {}).get("url")
+
+    return assets
+
+
+def _upload_asset(session: "requests.Session", upload_url: str, file: Path) -> None:
+    """Upload a file as a release asset.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session used to make the request
+    upload_url : str
+        The upload URL of the release, without the URI template
+    file : Path
+        The file to upload. The asset is named after the file.
+    """
+    # Stream the file straight from disk
+    # (uploads can take a while to be processed, hence the longer timeout)
+    with open(file, "rb") as f:
+        response = session.post(
+            upload_url,
+            params={"name": file.name},
+            headers={"Content-Type": "application/octet-stream"},
+            data=f,
+            timeout=300,
+        )
+    response.raise_for_status()
+
+
+def _delete_asset(session: "requests.Session", github_name: str, asset: dict) -> None:
+    """Delete a release asset.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session used to make the request
+    github_name : str
+        The name of the Github repository, in the form owner/repo
+    asset : dict
+        The asset info returned by the Github API
+    """
+    import github_release
+
+    url = f"{github_release.github_api_url()}/repos/{github_name}"
+    url += f"/releases/assets/{asset['id']}"
+    response = session.delete(url, timeout=60)
+    response.raise_for_status()
+
 
 class Stage(ABC):
     """Abstract base class for workflow stages.
@@ -61,7 +334,7 @@ class Stage(ABC):
         # Save the parameters
         self.name = name
         self.output = output
-        self.dependencies = dependencies
+        self.dependencies = _normalize_dependencies(dependencies)
         self.cache = cache
         self.wf_vars = SimpleNamespace() if wf_vars is None else wf_vars
         self.stage_vars = SimpleNamespace(**kwargs)
@@ -69,8 +342,7 @@ class Stage(ABC):
 
         # If no paths provided, just use root path
         if paths is None:
-            git_repo = git.Repo(".", search_parent_directories=True)
-            self.paths = SimpleNamespace(root=Path(git_repo.working_tree_dir))
+            self.paths = SimpleNamespace(root=find_repo_root())
         else:
             self.paths = paths
 
@@ -83,9 +355,12 @@ class Stage(ABC):
         # Start with empty resolution status
         self.resolution = None
 
-    @property
+    @functools.cached_property
     def _output_list(self) -> list:
-        """Return the output in a list."""
+        """Return the output in a list.
+
+        This is computed once, as the output is fixed when the stage is created.
+        """
         # Get the output
         output = self.output
 
@@ -104,16 +379,45 @@ class Stage(ABC):
 
     def _prep_output_destination(self) -> None:
         """Create the output parent directory if it does not exist."""
-        # Get output list
-        output = self._output_list
+        # Get the unique parent directories, preserving order
+        parents = dict.fromkeys(file.parent for file in self._output_list)
+
+        # Create any missing directories
+        for parent in parents:
+            if self.verbose and not parent.exists():
+                print(f"Creating output directory '{parent}'")
+            parent.mkdir(parents=True, exist_ok=True)
 
-        # Loop over files
+    def _stat_outputs(self, output: str | Path | None = None) -> list:
+        """Stat the output files.
+
+        Each file is stat-ed once, so that existence and timestamps can be
+        read from the same result.
+
+        Parameters
+        ----------
+        output: str or Path or None, default=None
+            The output to stat. If None, all outputs are stat-ed.
+
+        Returns
+        -------
+        list
+            The os.stat_result for each file, or None if the file is missing
+        """
+        # Determine the output to query
+        if output is None:
+            output = self._output_list
+        else:
+            output = [Path(output)]
+
+        stats = []
         for file in output:
-            if file.parent.exists():
-                continue
-            if self.verbose:
-                print(f"Creating parent directory for output '{file}'")
-            file.parent.mkdir(parents=True)
+            try:
+                stats.append(os.stat(file))
+            except FileNotFoundError:
+                stats.append(None)
+
+        return stats
 
     def _check_output_exists(self, output: str | Path | None = None) -> bool:
         """Return whether the output exists locally.
@@ -129,13 +433,7 @@ class Stage(ABC):
         bool
             Whether the output exits locally
         """
-        # Determine the output to query
-        if output is None:
-            output = self._output_list
-        else:
-            output = [output]
-
-        return all([file.exists() for file in output])
+        return all(stat is not None for stat in self._stat_outputs(output))
 
     def _get_local_time(self, output: str | Path | None = None) -> float:
         """Get the local timestamp for the output.
@@ -151,16 +449,11 @@ class Stage(ABC):
         float
             The local time in seconds. This is a Unix timestamp.
         """
-        if not self._check_output_exists():
+        stats = self._stat_outputs(output)
+        if any(stat is None for stat in stats):
             return -99
 
-        # Determine the output to query
-        if output is None:
-            output = self._output_list
-        else:
-            output = [output]
-
-        return min([file.stat().st_mtime for file in output])
+        return min(stat.st_mtime for stat in stats)
 
     def _get_cache_time(
         self,
@@ -182,8 +475,8 @@ class Stage(ABC):
         float
             The cache time in seconds. This is a Unix timestamp.
         """
-        # If no workflow, don't even try
-        if workflow is None:
+        # If no workflow or cache tag, don't even try
+        if workflow is None or workflow.cache_tag is None:
             return -99
 
         # Connect to workflow cache
@@ -199,19 +492,9 @@ class Stage(ABC):
         else:
             output = [output]
 
-        # Return time stamps for files
-        try:
-            times = []
-            for file in output:
-                info = github_release.get_asset_info(
-                    workflow.github_name,
-                    workflow.cache_tag,
-                    file.name,
-                )
-                times.append(datetime.fromisoformat(info["updated_at"]).timestamp())
-            return min(times)
-        except Exception:
-            return -99
+        # Return time stamps for files, looked up in the workflow's asset index
+        times = workflow._cache_times
+        return min(times.get(file.name, -99) for file in output)
 
     def _check_output_cache_exists(
         self,
@@ -243,8 +526,8 @@ class Stage(ABC):
         workflow: Workflow or None
             Workflow with a cache
         """
-        # If no workflow, don't even try
-        if workflow is None:
+        # If no workflow or cache tag, don't even try
+        if workflow is None or workflow.cache_tag is None:
             return
 
         # Connect to workflow cache
@@ -254,48 +537,50 @@ class Stage(ABC):
         if not workflow._cache_connected:
             return
 
-        # Get output list
-        output = self._output_list
-
-        # Get lists of cache assets
-        asset_names = [
-            asset["name"]
-            for asset in github_release.get_assets(
-                workflow.github_name, workflow.cache_tag
-            )
+        # Determine which files are newer than their cached versions
+        stale = [
+            file
+            for file in self._output_list
+            if self._get_cache_time(workflow, file) < self._get_local_time(file)
         ]
 
-        # Loop over every file
-        for file in output:
-            # Get the timestamps
-            local_mt = self._get_local_time(file)
-            cache_mt = self._get_cache_time(workflow, file)
+        # If the contents of a file match its cached asset (e.g. after a checkout
+        # or touch), we only need to sync the timestamp, not re-upload the file
+        for file in stale.copy():
+            digest = workflow._cache_assets.get(file.name, {}).get("digest")
+            if digest is not None and digest == _file_digest(file):
+                cache_time = self._get_cache_time(workflow, file)
+                os.utime(file, times=(cache_time, cache_time))
+                stale.remove(file)
 
-            # Skip if cache up-to-date
-            if cache_mt >= local_mt:
-                continue
+        if len(stale) == 0:
+            return
 
-            # Otherwise we need to cache the output in an asset
+        for file in stale:
             print(f"Caching '{file}'")
 
+        # All transfers share the workflow's pooled connections
+        session = workflow._session
+
+        def upload(file: Path) -> None:
             # If asset already in cache, we must delete it first
-            if file.name in asset_names:
-                with workflow._get_print_context():
-                    github_release.gh_asset_delete(
-                        workflow.github_name,
-                        workflow.cache_tag,
-                        file.name,
-                    )
+            asset = workflow._cache_assets.get(file.name)
+            if asset is not None:
+                _delete_asset(session, workflow.github_name, asset)
 
             # Now upload asset
-            with workflow._get_print_context():
-                github_release.gh_asset_upload(
-                    workflow.github_name,
-                    workflow.cache_tag,
-                    str(file),
-                )
+            _upload_asset(session, workflow._cache_upload_url, file)
+
+        # Upload the files in parallel, as each transfer is network bound
+        n_workers = min(workflow.concurrent_transfers, len(stale))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(upload, stale))
+
+        # Update the asset index with the new uploads
+        workflow._refresh_cache_assets()
 
-            # Set local timestamp to match cache
+        # Set local timestamps to match cache
+        for file in stale:
             cache_time = self._get_cache_time(workflow, file)
             os.utime(file, times=(cache_time, cache_time))
 
@@ -324,20 +609,28 @@ class Stage(ABC):
         # Make sure the output parent directory exists
         self._prep_output_destination()
 
-        # Loop over files
-        for file in output:
+        # Make sure every file is in the cache
+        missing = [file for file in output if file.name not in workflow._cache_assets]
+        if len(missing) > 0:
+            raise RuntimeError(f"Outputs {missing} not found in the cache.")
+
+        # Share one HTTP session between the downloads
+        session = workflow._session
+
+        def download(file: Path) -> None:
             # Download the cached file
-            with contextlib.chdir(file.parent), workflow._get_print_context():
-                github_release.gh_asset_download(
-                    workflow.github_name,
-                    workflow.cache_tag,
-                    str(file.name),
-                )
+            asset = workflow._cache_assets[file.name]
+            _download_asset(session, workflow.github_name, asset, file)
 
             # Set the last modified time of the downloaded file to match the cache
-            cache_time = self._get_cache_time(workflow, file)
+            cache_time = workflow._cache_times[file.name]
             os.utime(file, times=(cache_time, cache_time))
 
+        # Download the files in parallel, as each transfer is network bound
+        n_workers = min(workflow.concurrent_transfers, len(output))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(download, output))
+
     @property
     def _stage_hash(self) -> str:
         """The stage hash.
@@ -347,38 +640,66 @@ class Stage(ABC):
         str
             Hash as a hexadecimal equivalent encoded string
         """
-        with open(self._stage_file, "rb") as file:
-            stage_hash = hashlib.md5(file.read()).hexdigest()
+        return _hash_file(self._stage_file)
+
+    def _load_stage_history(self) -> dict:
+        """Load the stage history.
+
+        The caller must hold _stage_history_lock.
+
+        Returns
+        -------
+        dict
+            The hash of each stage, keyed by stage name. Empty if the
+            stage history does not exist.
+        """
+        if not self._stage_history_file.exists():
+            return {}
 
-        return stage_hash
+        with open(self._stage_history_file) as file:
+            return json.load(file)
+
+    def _save_stage_history(self, stage_history: dict) -> None:
+        """Save the stage history.
+
+        The history is written to a temporary file that then replaces the
+        old one, so readers never see a partially written file.
+        The caller must hold _stage_history_lock.
+
+        Parameters
+        ----------
+        stage_history : dict
+            The hash of each stage, keyed by stage name
+        """
+        tmp = self._stage_history_file.with_name(self._stage_history_file.name + ".tmp")
+        with open(tmp, "w") as file:
+            json.dump(stage_history, file, indent=2)
+        os.replace(tmp, self._stage_history_file)
 
     def _update_stage_hash(self) -> None:
         """Update the stage hash."""
-        # Load stage history if it exists
-        if self._stage_history_file.exists():
-            stage_history = json.load(open(self._stage_history_file))
-        else:
-            stage_history = {}
+        # Lock the history, as stages may finish concurrently
+        with _stage_history_lock:
+            stage_history = self._load_stage_history()
 
-        # Add new hash to the history
-        stage_history[self.name] = self._stage_hash
+            # Add new hash to the history
+            stage_history[self.name] = self._stage_hash
 
-        # Save stage history
-        json.dump(stage_history, open(self._stage_history_file, "w"), indent=2)
+            self._save_stage_history(stage_history)
 
     def _delete_stage_hash(self) -> None:
         """Delete the stage hash."""
-        # Load stage history if it exists
-        if self._stage_history_file.exists():
-            stage_history = json.load(open(self._stage_history_file))
-        else:
-            return
+        # Lock the history, as stages may finish concurrently
+        with _stage_history_lock:
+            # If there is no stage history, there is nothing to delete
+            if not self._stage_history_file.exists():
+                return
+            stage_history = self._load_stage_history()
 
-        # Remove this stage from the history
-        stage_history.pop(self.name, None)
+            # Remove this stage from the history
+            stage_history.pop(self.name, None)
 
-        # Save stage history
-        json.dump(stage_history, open(self._stage_history_file, "w"), indent=2)
+            self._save_stage_history(stage_history)
 
     def _has_stage_changed(self) -> bool:
         """Whether the stage definition has changed.
@@ -388,12 +709,10 @@ class Stage(ABC):
         bool
             Whether the stage has changed.
         """
-        # If stage history does not exist, the stage has changed
-        if not self._stage_history_file.exists():
-            return True
-
         # Load the stage history
-        stage_history = json.load(open(self._stage_history_file))
+        # (locked, as other stages may be updating it concurrently)
+        with _stage_history_lock:
+            stage_history = self._load_stage_history()
 
         # If the stage is not in the stage history, the stage has changed
         if self.name not in stage_history:
@@ -425,24 +744,22 @@ class Stage(ABC):
                     has been updated more recently than the corresponding outputs,
                     so the rule needs to be re-run.
         """
-        # Check existence
-        exist_local = self._check_output_exists()
-        exist_cache = self._check_output_cache_exists(workflow)
+        # Get time stamps, which are -99 if the output doesn't exist
+        local_time = self._get_local_time()
+        cache_time = self._get_cache_time(workflow)
 
-        # Check if the stage changed
-        stage_changed = self._has_stage_changed()
+        # Check existence
+        exist_local = local_time > -99
+        exist_cache = cache_time > -99
 
         # Determine which item is the newest
-        if stage_changed or not (exist_local or exist_cache):
+        # (only hashing the stage if some output exists)
+        if not (exist_local or exist_cache) or self._has_stage_changed():
             newest = "stage"
+        elif local_time >= cache_time:
+            newest = "local"
         else:
-            # Get time stamps
-            local_time = self._get_local_time()
-            cache_time = self._get_cache_time(workflow)
-            if local_time >= cache_time:
-                newest = "local"
-            else:
-                newest = "cache"
+            newest = "cache"
 
         return {
             "local": exist_local,
@@ -517,11 +834,11 @@ class Stage(ABC):
             A workflow with wf_vars and a cache
         """
         # Check outputs exist
-        for file in self._output_list:
-            if not self._check_output_exists(file):
-                raise RuntimeError(
-                    f"Stage '{self.name}' completed but output '{file}' is missing!"
-                )
+        missing = [str(file) for file in self._output_list if not file.exists()]
+        if len(missing) > 0:
+            raise RuntimeError(
+                f"Stage '{self.name}' completed but outputs {missing} are missing!"
+            )
 
         # Cache output
         if self.cache and self.resolution != "cache":
@@ -613,7 +930,8 @@ class Workflow:
     and downloading cached outputs from Github releases.
 
     Note for the Github cache to work, you must have a Github personal access
-    token saved under $GITHUB_TOKEN
+    token saved under $GITHUB_TOKEN. Set workflow.offline = True (or pass
+    --offline to the CLI) to skip the cache entirely.
     """
 
     def __init__(self, **kwargs) -> None:
@@ -624,27 +942,85 @@ class Workflow:
         **kwargs
             Any keyword arguments to add to the workflow global variables.
         """
-        # Create an empty list of stages
+        # Create an empty list of stages, and an index of them by name
         self.stages = []
-
-        # Get git and github info
-        self.git_repo = git.Repo(".", search_parent_directories=True)
-        gh_url = self.git_repo.remotes.origin.url
-        self.github_name = gh_url.removeprefix("git@github.com:").removesuffix(".git")
+        self._stages_by_name = {}
 
         # Start with an empty cache tag
         self.cache_tag = None
         self._cache_tags = []
         self._cache_connected = None
+        self._cache_upload_url = None
+        self._cache_release_id = None
+
+        # Index of the cache assets and their timestamps, keyed by file name
+        self._cache_assets = {}
+        self._cache_times = {}
+
+        # Maximum number of files to upload or download at once
+        self.concurrent_transfers = 8
 
         # Create the root paths object
-        self.paths = SimpleNamespace(root=Path(self.git_repo.working_tree_dir))
+        self.paths = SimpleNamespace(root=find_repo_root())
 
         # Save the workflow variables
         self.wf_vars = SimpleNamespace(**kwargs)
 
-        # Default to not verbose
+        # Default to not verbose, and to using the remote cache
         self.verbose = False
+        self.offline = False
+
+        # Whether stages are currently being run in multiple threads
+        self._running_concurrently = False
+
+    @functools.cached_property
+    def _session(self) -> "requests.Session":
+        """HTTP session for the cache transfers, so that connections are reused."""
+        import requests
+        from urllib3.util import Retry
+
+        session = requests.Session()
+
+        # Authenticate the same way as github_release
+        token = os.environ.get("GITHUB_TOKEN")
+        if token is not None:
+            session.auth = (token, "x-oauth-basic")
+
+        # Keep a connection open for each concurrent transfer, and retry
+        # requests that fail due to transient server errors
+        # (POSTs are not retried, as the upload stream has been consumed)
+        retry = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=self.concurrent_transfers,
+            max_retries=retry,
+        )
+        session.mount("https://", adapter)
+
+        return session
+
+    @functools.cached_property
+    def github_name(self) -> str:
+        """The name of the Github repository, in the form owner/repo."""
+        # Find the git directory
+        # (in a worktree or submodule, .git is a file that points to it)
+        git_dir = self.paths.root / ".git"
+        if git_dir.is_file():
+            gitdir_line = git_dir.read_text().strip()
+            git_dir = self.paths.root / gitdir_line.removeprefix("gitdir:").strip()
+
+        # Worktrees share the config of the main repository
+        if (git_dir / "commondir").is_file():
+            git_dir = git_dir / (git_dir / "commondir").read_text().strip()
+
+        # Read the origin URL straight from the git config
+        config = configparser.ConfigParser(strict=False, interpolation=None)
+        config.read(git_dir / "config")
+        gh_url = config['remote "origin"']["url"]
+
+        # Handle both SSH and HTTPS remotes
+        for prefix in ["git@github.com:", "https://github.com/"]:
+            gh_url = gh_url.removeprefix(prefix)
+        return gh_url.removesuffix("/").removesuffix(".git")
 
     def _get_print_context(self) -> ContextManager:
         """Get the print context for the verbosity level.
@@ -654,10 +1030,12 @@ class Workflow:
         ContextManager
             A context manager that hides print statements if self.verbose==False
         """
-        if self.verbose:
+        # Redirecting stdout affects every thread, so we can't do it safely
+        # while stages are running concurrently
+        if self.verbose or self._running_concurrently:
             return contextlib.nullcontext()
         else:
-            return contextlib.redirect_stdout(None)
+            return contextlib.redirect_stdout(_NullWriter())
 
     @staticmethod
     def _no_connection_warning() -> None:
@@ -676,11 +1054,19 @@ class Workflow:
         if self._cache_connected is not None:
             return
 
+        # If offline, don't even try to reach Github
+        if self.offline:
+            self._cache_connected = False
+            return
+
+        import github_release
+
         # Check we can connect to Github
         try:
-            github_release.get_refs(self.github_name)
+            with _github_release_errors():
+                github_release.get_refs(self.github_name)
             self._cache_connected = True
-        except Exception as exc:
+        except _CACHE_ERRORS as exc:
             self._cache_connected = False
 
             # If no cache tag was provided, just return
@@ -716,6 +1102,41 @@ class Workflow:
         # Save the list of cache tags
         self._cache_tags = tags
 
+        # Save the release ID and upload URL, so assets can be listed and
+        # uploaded without looking the release up by tag again
+        # (the URL ends in a URI template for the query, which we drop)
+        if self.cache_tag is not None:
+            releases_by_tag = {rel["tag_name"]: rel for rel in releases}
+            try:
+                # A new release isn't in the list, so we must look it up
+                release = releases_by_tag.get(self.cache_tag)
+                if release is None:
+                    with _github_release_errors():
+                        release = github_release.get_release_info(
+                            self.github_name,
+                            self.cache_tag,
+                        )
+                self._cache_release_id = release["id"]
+                self._cache_upload_url = release["upload_url"].split("{")[0]
+            # If we can't find the release, treat the cache as unavailable
+            except _CACHE_ERRORS as exc:
+                self._cache_connected = False
+                if self.verbose:
+                    print(exc)
+                self._no_connection_warning()
+                return
+
+        # Fetch the info for every asset in the cache at once
+        # (if we can't, treat the cache as unavailable)
+        try:
+            self._refresh_cache_assets()
+        except _CACHE_ERRORS as exc:
+            self._cache_connected = False
+            if self.verbose:
+                print(exc)
+            self._no_connection_warning()
+            return
+
         # Print the cache info
         if self.verbose:
             self.query_cache(include_assets=False)
@@ -723,6 +1144,29 @@ class Workflow:
         # Add a blank line after cache info
         print()
 
+    def _refresh_cache_assets(self) -> None:
+        """Refresh the index of the assets saved in the cache.
+
+        The index maps asset names to their info, which lets stages look up
+        cache times locally instead of querying Github for every file.
+        The timestamps are parsed once here, rather than on every lookup.
+        """
+        # If there is no cache, there are no assets
+        if not self._cache_connected or self._cache_release_id is None:
+            assets = []
+        else:
+            assets = _list_assets(
+                self._session,
+                self.github_name,
+                self._cache_release_id,
+            )
+
+        self._cache_assets = {asset["name"]: asset for asset in assets}
+        self._cache_times = {
+            name: datetime.fromisoformat(asset["updated_at"]).timestamp()
+            for name, asset in self._cache_assets.items()
+        }
+
     def get_existing_cache_tags(self, _cli_print: bool = False) -> list:
         """Get list of existing cache tags.
 
@@ -760,6 +1204,9 @@ class Workflow:
         dict
             Dictionary containing cache info
         """
+        import github_release
+        import humanize
+
         self._connect_to_cache()
 
         # Get the cache info
@@ -770,13 +1217,13 @@ class Workflow:
 
         # Remove asset info it it's not wanted
         if not include_assets:
-            info.pop("assets")
+            info.pop("assets", None)
 
         # Print a nicely formatted summary of key information
         if self.verbose or _cli_print:
             try:
                 author = info["author"]["login"]
-            except Exception:
+            except (KeyError, TypeError):
                 author = None
             print(f"Release '{info.get('name')}' info")
             print(f"  {'Tag name':<13}: {info.get('tag_name')}")
@@ -807,17 +1254,28 @@ class Workflow:
             A boolean that must be set to true in order to delete the cache.
             This is to provide an extra safety check before deleting.
         """
+        import github_release
+
         if not confirm:
             print("Not deleting cache because confirm==False.")
             return
 
+        # Check there is a cache to delete
         self._connect_to_cache()
+        if self.cache_tag not in self._cache_tags:
+            print(f"Could not delete cache with tag '{self.cache_tag}'")
+            return
+
         try:
             print(f"Deleting cache with tag '{self.cache_tag}'")
-            with self._get_print_context():
+            with self._get_print_context(), _github_release_errors():
                 github_release.gh_release_delete(self.github_name, self.cache_tag)
             self._cache_tags.remove(self.cache_tag)
-        except Exception as exc:
+            self._cache_upload_url = None
+            self._cache_release_id = None
+            self._cache_assets = {}
+            self._cache_times = {}
+        except _CACHE_ERRORS as exc:
             if self.verbose:
                 print(exc)
             print(f"Could not delete cache with tag '{self.cache_tag}'")
@@ -831,21 +1289,53 @@ class Workflow:
             A boolean that must be set to true in order to delete the cache.
             This is to provide an extra safety check before deleting.
         """
+        import github_release
+
         if not confirm:
             print("Not deleting caches because confirm==False.")
             return
 
         self._connect_to_cache()
-        try:
-            print("Deleting all caches")
-            for tag in self.get_existing_cache_tags():
-                with self._get_print_context():
-                    github_release.gh_release_delete(self.github_name, tag)
+        print("Deleting all caches")
+        tags = self.get_existing_cache_tags()
+
+        def delete(tag: str) -> None:
+            with _github_release_errors():
+                github_release.gh_release_delete(self.github_name, tag)
+
+        # Delete the releases in parallel, as each request is network bound
+        n_workers = max(1, min(self.concurrent_transfers, len(tags)))
+        with self._get_print_context():
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = {tag: executor.submit(delete, tag) for tag in tags}
+
+        # Forget the deleted caches, and report any we couldn't delete
+        # (unexpected errors are saved until all the bookkeeping is done)
+        failed = []
+        unexpected = None
+        for tag, future in futures.items():
+            exc = future.exception()
+            if exc is None:
                 self._cache_tags.remove(tag)
-        except Exception as exc:
-            if self.verbose:
+                continue
+
+            failed.append(tag)
+            if not isinstance(exc, _CACHE_ERRORS):
+                unexpected = exc if unexpected is None else unexpected
+            elif self.verbose:
                 print(exc)
-            print("Could not delete all caches")
+
+        if self.cache_tag not in self._cache_tags:
+            self._cache_upload_url = None
+            self._cache_release_id = None
+            self._cache_assets = {}
+            self._cache_times = {}
+
+        if len(failed) > 0:
+            print(f"Could not delete caches with tags {failed}")
+
+        if unexpected is not None:
+            raise unexpected
 
     def add_stage(
         self,
@@ -886,28 +1376,20 @@ class Workflow:
             Any other keywords to pass to the function.
         """
         # Check the name is unique:
-        for prev_stage in self.stages:
-            if name == prev_stage.name:
-                raise ValueError(
-                    f"There is more than one stage with the name '{name}'."
-                )
+        if name in self._stages_by_name:
+            raise ValueError(f"There is more than one stage with the name '{name}'.")
 
         # Check that any dependencies are already in the stage list
-        if dependencies is None:
-            pass
-        elif isinstance(dependencies, (tuple, list)):
-            for dep in dependencies:
-                if not any(dep == stage.name for stage in self.stages):
-                    raise ValueError(
-                        f"Dependency '{dep}' for '{name}' not found. "
-                        "Remember the order in which you add stages does matter!"
-                    )
-        else:
-            if not any(dependencies == stage.name for stage in self.stages):
-                raise ValueError(
-                    f"Dependency '{dependencies}' for '{name}' not found. "
-                    "Remember the order in which you add stages does matter!"
-                )
+        missing = [
+            dep
+            for dep in _normalize_dependencies(dependencies)
+            if dep not in self._stages_by_name
+        ]
+        if len(missing) > 0:
+            raise ValueError(
+                f"Dependencies {missing} for '{name}' not found. "
+                "Remember the order in which you add stages does matter!"
+            )
 
         # If stage is None, use DummyStage
         if stage is None:
@@ -922,17 +1404,17 @@ class Workflow:
             wf_vars = SimpleNamespace(**self.wf_vars.__dict__.copy())
 
         # Add the stage to the list
-        self.stages.append(
-            stage(
-                name=name,
-                output=output,
-                dependencies=dependencies,
-                cache=cache,
-                paths=paths,
-                wf_vars=wf_vars,
-                **kwargs,
-            )
+        stage = stage(
+            name=name,
+            output=output,
+            dependencies=dependencies,
+            cache=cache,
+            paths=paths,
+            wf_vars=wf_vars,
+            **kwargs,
         )
+        self.stages.append(stage)
+        self._stages_by_name[name] = stage
 
     def query_stages(self, *, _cli_print: bool = False) -> dict:
         """Query current status of every stage.
@@ -950,6 +1432,9 @@ class Workflow:
                 stage has been updated more recently than the corresponding outputs,
                 so the rule needs to be re-run.
         """
+        # Make sure we hash the current version of each stage file
+        _hash_file.cache_clear()
+
         # Get the status of the workflow
         status = {stage.name: stage.query() for stage in self.stages}
 
@@ -971,11 +1456,7 @@ class Workflow:
             The name of the stage for which to update the hash.
         """
         # Find the stage
-        stage = None
-        for st in self.stages:
-            if st.name == stage_name:
-                stage = st
-                break
+        stage = self._stages_by_name.get(stage_name)
 
         # Raise error if no matching stage found
         if stage is None:
@@ -993,11 +1474,7 @@ class Workflow:
             The name of the stage for which to delete the hash.
         """
         # Find the stage
-        stage = None
-        for st in self.stages:
-            if st.name == stage_name:
-                stage = st
-                break
+        stage = self._stages_by_name.get(stage_name)
 
         # Raise error if no matching stage found
         if stage is None:
@@ -1006,19 +1483,26 @@ class Workflow:
         # Update the stage hash
         stage._delete_stage_hash()
 
-    def run(self) -> None:
-        """Run the workflow."""
+    def run(self, max_workers: int = 1) -> None:
+        """Run the workflow.
+
+        Parameters
+        ----------
+        max_workers : int, default=1
+            The maximum number of stages to run at once. If greater than 1,
+            each stage is started in a thread as soon as all its dependencies
+            have completed. Note that output from the cache and Github is
+            no longer hidden when stages run concurrently.
+        """
+        # Make sure we hash the current version of each stage file
+        _hash_file.cache_clear()
+
         # Keep track of all re-run stages
-        rerun_stages = []
+        rerun_stages = set()
 
-        for stage in self.stages:
+        def run_stage(stage: Stage) -> None:
             # Check if dependencies have been re-run
-            if stage.dependencies is None:
-                dep_changed = False
-            elif isinstance(stage.dependencies, (tuple, list)):
-                dep_changed = any([dep in rerun_stages for dep in stage.dependencies])
-            else:
-                dep_changed = stage.dependencies in rerun_stages
+            dep_changed = not rerun_stages.isdisjoint(stage.dependencies)
 
             # Run the stage
             stage.run(
@@ -1026,68 +1510,119 @@ class Workflow:
                 dep_changed=dep_changed,
             )
 
-            # If this stage was run, save it in the re-run list
-            if stage.resolution == "run":
-                rerun_stages.append(stage.name)
+        if max_workers == 1:
+            for stage in self.stages:
+                run_stage(stage)
+
+                # If this stage was run, save it in the re-run list
+                if stage.resolution == "run":
+                    rerun_stages.add(stage.name)
+        else:
+            self._run_concurrently(run_stage, rerun_stages, max_workers)
 
         print("\nWorkflow completed!")
 
+    def _run_concurrently(
+        self,
+        run_stage: Callable,
+        rerun_stages: set,
+        max_workers: int,
+    ) -> None:
+        """Run the stages concurrently, following the dependency graph.
+
+        Parameters
+        ----------
+        run_stage : Callable
+            Function that runs a single stage
+        rerun_stages : set
+            The set in which to save the names of re-run stages
+        max_workers : int
+            The maximum number of stages to run at once
+        """
+        # Connect to the cache before starting any threads
+        if self.cache_tag is not None:
+            self._connect_to_cache()
+
+        pending = list(self.stages)
+        running = {}
+        completed = set()
+
+        self._running_concurrently = True
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                while len(pending) > 0 or len(running) > 0:
+                    # Start every stage whose dependencies have completed
+                    for stage in pending.copy():
+                        if completed.issuperset(stage.dependencies):
+                            running[executor.submit(run_stage, stage)] = stage
+                            pending.remove(stage)
+
+                    # Wait for a stage to finish
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        stage = running.pop(future)
+                        future.result()
+                        completed.add(stage.name)
+
+                        # If this stage was run, save it in the re-run list
+                        if stage.resolution == "run":
+                            rerun_stages.add(stage.name)
+        finally:
+            self._running_concurrently = False
+
     def cli(self) -> None:
-        """Create command-line interface for the workflow."""
+        """Run the command-line interface for the workflow."""
+        self._typer_app()
+
+    @functools.cached_property
+    def _typer_app(self) -> "typer.Typer":
+        """The Typer app that defines the command-line interface."""
+        import typer
+
         # Create a Typer app
         app = typer.Typer(add_completion=False, no_args_is_help=True)
 
         # Add global options
         @app.callback()
-        def main(verbose: bool = False):
+        def main(verbose: bool = False, offline: bool = False):
             """Command line interface for a workflow"""
             self.verbose = verbose
+            self.offline = offline
 
         # Command to list existing cache tags
         @app.command()
+        @_typer_help(self.get_existing_cache_tags)
         def get_existing_cache_tags(include_assets: bool = True):
             self.get_existing_cache_tags(_cli_print=True)
 
-        get_existing_cache_tags.__doc__ = self.get_existing_cache_tags.__doc__.replace(
-            "\n\n", "\n\n\b"
-        )
-
         # Command to delete cache
         @app.command()
+        @_typer_help(self.delete_cache)
         def delete_cache(confirm: bool) -> None:
             self.delete_cache(confirm=confirm)
 
-        delete_cache.__doc__ = self.delete_cache.__doc__.replace("\n\n", "\n\n\b")
-
         # Command to delete all caches
         @app.command()
+        @_typer_help(self.delete_all_caches)
         def delete_all_caches(confirm: bool) -> None:
             self.delete_all_caches(confirm=confirm)
 
-        delete_all_caches.__doc__ = self.delete_all_caches.__doc__.replace(
-            "\n\n", "\n\n\b"
-        )
-
         # Command to print cache query
         @app.command()
+        @_typer_help(self.query_cache)
         def query_cache(include_assets: bool = True) -> None:
             self.query_cache(include_assets=include_assets, _cli_print=True)
 
-        query_cache.__doc__ = self.query_cache.__doc__.replace("\n\n", "\n\n\b")
-
         # Command to print stage query
         @app.command()
+        @_typer_help(self.query_stages)
         def query_stages() -> None:
             self.query_stages(_cli_print=True)
 
-        query_stages.__doc__ = self.query_stages.__doc__.replace("\n\n", "\n\n\b")
-
         # Command to run stages
         @app.command()
-        def run() -> None:
-            self.run()
-
-        run.__doc__ = self.run.__doc__.replace("\n\n", "\n\n\b")
+        @_typer_help(self.run)
+        def run(max_workers: int = 1) -> None:
+            self.run(max_workers=max_workers)
 
-        # Run CLI
-        app()
+        return app